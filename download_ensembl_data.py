@@ -1,14 +1,38 @@
 import os
 import sys
+import json
 import time
-import gzip
-import random
+import shlex
+import shutil
 import ftplib
+import socket
 import logging
+import threading
 import argparse
 import subprocess
+from queue import Queue
 from pathlib import Path
-from multiprocessing import Pool
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    # ISA-L drop-in replacements, several times faster at inflating large genome files
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib
+
+# read/write size for FTP transfers; the ftplib default of 8 KiB is far too small for genome files
+BLOCK_SIZE = 1 << 20
+# seconds without any data on a control or data connection before giving up on it
+FTP_TIMEOUT = 120
+# receive buffer requested for FTP sockets, large enough for the bandwidth-delay product of long-distance links
+SOCKET_RCVBUF = 8 << 20
+# seconds the control connection may sit idle, e.g. during a long download, before TCP keepalives are sent
+KEEPALIVE_IDLE = 60
+# species listings are kept here between runs
+CACHE_DIR = Path.home() / '.cache' / 'ensembl_refs'
+# seconds a cached listing is reused, 'current' can move to a new release at any time
+CACHE_TTL = 24 * 60 * 60
 
 def setup_logging():
     """Configure logging settings"""
@@ -17,17 +41,173 @@ def setup_logging():
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
 
+class RateLimiter:
+    """Space out requests to the FTP server, only once it has started refusing or dropping them"""
+    def __init__(self, max_interval=3.0):
+        self.interval = 0.0
+        self.max_interval = max_interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for the next free slot"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if wait:
+            time.sleep(wait)
+
+    def backoff(self):
+        """Double the interval between requests after a failure"""
+        with self._lock:
+            self.interval = min(self.max_interval, self.interval * 2 or 0.5)
+
+    def relax(self):
+        """Halve the interval between requests after a success"""
+        with self._lock:
+            self.interval = self.interval / 2 if self.interval > 0.1 else 0.0
+
+# shared by all download threads, there is a single FTP server per run
+rate_limiter = RateLimiter()
+# directory listings retrieved during this run keyed by path, shared by all pooled connections
+listing_cache = {}
+
+def tune_socket(sock):
+    """Disable Nagle's algorithm and enlarge the receive buffer of a socket"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+
+class EnsemblFTP(ftplib.FTP):
+    """ftplib.FTP with control and data sockets tuned for large transfers over high-latency links"""
+    def __init__(self, *args, **kwargs):
+        # parsed CHECKSUMS already retrieved over this connection, keyed by path
+        self.checksums_cache = {}
+        # last TYPE command accepted by the server
+        self.transfer_type = None
+        # a data transfer was started and its final reply not read yet, when this is left set
+        # by a failed transfer the control channel is a reply behind and the connection is unusable
+        self.awaiting_reply = False
+        super().__init__(*args, **kwargs)
+
+    def connect(self, *args, **kwargs):
+        welcome = super().connect(*args, **kwargs)
+        self.transfer_type = None
+        self.awaiting_reply = False
+        tune_socket(self.sock)
+        # keep NAT gateways and firewalls from dropping the control connection while it waits for a transfer
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+        return welcome
+
+    def sendcmd(self, cmd):
+        # ftplib sends TYPE before every transfer, only send it when it changes
+        if cmd.startswith('TYPE '):
+            if cmd == self.transfer_type:
+                return '200 Type unchanged'
+            resp = super().sendcmd(cmd)
+            self.transfer_type = cmd
+            return resp
+        return super().sendcmd(cmd)
+
+    def voidcmd(self, cmd):
+        if cmd.startswith('TYPE '):
+            resp = self.sendcmd(cmd)
+            if not resp.startswith('2'):
+                raise ftplib.error_reply(resp)
+            return resp
+        return super().voidcmd(cmd)
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = super().ntransfercmd(cmd, rest)
+        self.awaiting_reply = True
+        tune_socket(conn)
+        # the kernel may cap the requested size (net.core.rmem_max)
+        logging.debug(f"Data connection receive buffer: {conn.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes")
+        return conn, size
+
+    def voidresp(self):
+        try:
+            resp = super().voidresp()
+        except ftplib.Error:
+            # an error reply (e.g. 426) was read, the control channel is back in step
+            self.awaiting_reply = False
+            raise
+        self.awaiting_reply = False
+        return resp
+
 def create_ftp_connection(server):
     """Establish FTP connection"""
     try:
-        ftp = ftplib.FTP(server)
+        # a timeout turns a stalled transfer into an error that can be retried
+        ftp = EnsemblFTP(server, timeout=FTP_TIMEOUT)
         ftp.login()
         return ftp
     except Exception as e:
         logging.error(f"Failed to connect to {server}: {str(e)}")
+        rate_limiter.backoff()
         return None
 
-def get_ftp_files(ftp, division, release, species, file_type, extra_dir=''):
+def reconnect(ftp):
+    """Re-open and log in a dropped FTP connection in place"""
+    ftp.close()
+    ftp.connect(ftp.host, ftp.port)
+    ftp.login()
+
+class FTPPool:
+    """Pool of authenticated FTP connections reused across species downloads"""
+    def __init__(self, server, size, ftp=None):
+        self.server = server
+        self._queue = Queue()
+        # an already logged in connection is handed out first
+        self._queue.put(ftp)
+        # the others are opened lazily on first use
+        for _ in range(size - 1):
+            self._queue.put(None)
+
+    @contextmanager
+    def acquire(self):
+        """Borrow a live connection from the pool, reconnecting if it was dropped"""
+        ftp = self._queue.get()
+        if ftp is not None and ftp.awaiting_reply:
+            ftp.close()
+            ftp = None
+        if ftp is not None:
+            # only detects dropped connections, a stale reply left by a failed transfer would pass for its own
+            try:
+                ftp.voidcmd('NOOP')
+            except Exception:
+                ftp.close()
+                ftp = None
+        if ftp is None:
+            ftp = create_ftp_connection(self.server)
+        try:
+            yield ftp
+        except Exception:
+            # the control channel may be left in an unknown state
+            if ftp is not None:
+                ftp.close()
+            ftp = None
+            raise
+        finally:
+            if ftp is not None and ftp.awaiting_reply:
+                # a transfer failed without its reply being read, the next species gets a new connection
+                ftp.close()
+                ftp = None
+            self._queue.put(ftp)
+
+    def close(self):
+        """Close all open connections in the pool"""
+        while not self._queue.empty():
+            ftp = self._queue.get()
+            if ftp is not None:
+                try:
+                    ftp.quit()
+                except Exception:
+                    ftp.close()
+
+def ftp_dir_path(division, release, species, file_type, extra_dir=''):
     """Generate the appropriate FTP path based on division"""
     ftp_path = ''
     species_path = ''
@@ -39,28 +219,319 @@ def get_ftp_files(ftp, division, release, species, file_type, extra_dir=''):
         ftp_path = f"/pub/{release}/{file_type}{species_path}"
     else:
         ftp_path = f"/pub/{release}/{division}/{file_type}{species_path}"
+    return ftp_path
+
+def get_ftp_files(ftp, division, release, species, file_type, extra_dir=''):
+    """List the files of a species (or division) directory, each path is only listed once per run"""
+    ftp_path = ftp_dir_path(division, release, species, file_type, extra_dir)
+    
+    if ftp_path not in listing_cache:
+        try:
+            listing_cache[ftp_path] = list_ftp_dir(ftp, ftp_path)
+        except Exception as e:
+            logging.error(f"Error accessing {file_type} directory: {str(e)}; path tried: {ftp.host}{ftp_path}. Check if the path and release number are correct!")
+            return {}, ftp_path
+    
+    return listing_cache[ftp_path], ftp_path
+
+def list_ftp_dir(ftp, ftp_path):
+    """
+    List an FTP directory in a single command, using MLSD when the server supports it
     
+    Returns:
+        dict: Facts (type and size) of each entry keyed by name, empty facts when listed with NLST
+    """
     try:
-        ftp.cwd(ftp_path)
-    except Exception as e:
-        logging.error(f"Error accessing {file_type} directory: {str(e)}; path tried: {ftp.host}{ftp_path}. Check if the path and release number are correct!")
+        return {name: facts for name, facts in ftp.mlsd(ftp_path, facts=['type', 'size'])
+                if facts.get('type') not in ('cdir', 'pdir')}
+    except ftplib.error_perm as e:
+        # 500/501/502: MLSD is not implemented by the server
+        if not str(e).startswith('50'):
+            raise
+    return {name.rsplit('/', 1)[-1]: {} for name in ftp.nlst(ftp_path)}
+
+def probe_ftp_file(ftp, ftp_path, filename):
+    """
+    Check for a single file with one control-channel command instead of listing its directory
+    
+    Only an optimisation, any FTP or network error returns an empty dict so that the
+    caller falls back to listing the directory.
+    
+    Returns:
+        dict: Facts of the file keyed by its name, empty if it does not exist
+    """
+    remote_file = f"{ftp_path.rstrip('/')}/{filename}"
+    try:
+        try:
+            resp = ftp.sendcmd(f'MLST {remote_file}')
+        except ftplib.error_perm as e:
+            # 550: no such file
+            if not str(e).startswith('50'):
+                return {}
+            # 500/501/502: MLST is not implemented, SIZE only answers for existing files
+            try:
+                ftp.size(remote_file)
+            except ftplib.error_perm:
+                return {}
+            return {filename: {'type': 'file'}}
+    except ftplib.all_errors as e:
+        logging.debug(f'Probing {remote_file} failed, listing its directory instead: {e}')
+        if not isinstance(e, ftplib.Error):
+            # a reply may still be on its way after a timeout, the listing starts on a fresh connection
+            reconnect(ftp)
+        return {}
+    # the facts are on the single indented line between the 250- and 250 lines
+    for line in resp.splitlines()[1:-1]:
+        facts, _, _ = line.strip().partition(' ')
+        return {filename: {key.lower(): value for key, _, value in
+                           (fact.partition('=') for fact in facts.split(';') if fact)}}
+    return {filename: {}}
+
+class GunzipWriter:
+    """Decompress gzip data chunk by chunk into an open binary file"""
+    def __init__(self, out):
+        self.out = out
+        self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def write(self, chunk):
+        self.out.write(self._decompressor.decompress(chunk))
+        # a gzip file may contain several concatenated members
+        while self._decompressor.eof and self._decompressor.unused_data:
+            data = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            self.out.write(self._decompressor.decompress(data))
+
+    def close(self):
+        self.out.write(self._decompressor.flush())
+        if not self._decompressor.eof:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+def retrieve(ftp, remote_file, callback, rest=None, blocksize=BLOCK_SIZE):
+    """
+    Retrieve a file in binary mode, like ftplib.FTP.retrbinary
     
-    return ftp.nlst(), ftp_path
+    The data socket is read with recv_into into one reused blocksize buffer
+    instead of allocating a new bytes object per block. The memoryview
+    passed to callback is only valid until callback returns.
+    """
+    ftp.voidcmd('TYPE I')
+    buffer = bytearray(blocksize)
+    view = memoryview(buffer)
+    with ftp.transfercmd(f'RETR {remote_file}', rest) as conn:
+        while True:
+            size = conn.recv_into(buffer)
+            if not size:
+                break
+            callback(view[:size])
+    return ftp.voidresp()
 
-def download_file(ftp, remote_path, filename, local_dir, max_retries=3):
-    """Download a file from FTP server"""
-    local_path = os.path.join(local_dir, filename)
+def gz_uncompressed_size(gz_file):
+    """
+    Read the uncompressed size from the trailer of a gzip file
+    
+    The trailer stores the size modulo 4 GiB for the last member only, so the
+    value is a lower bound of the real size of larger or multi-member files.
+    """
+    with open(gz_file, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return int.from_bytes(f.read(4), 'little')
+
+def download_file(ftp, remote_path, filename, local_dir, max_retries=3, unzip=False, checksum=None, local_name=None,
+                  blocksize=BLOCK_SIZE, expected_size=None):
+    """
+    Download a file from FTP server
+    
+    Args:
+        ftp (ftplib.FTP): Active FTP connection object
+        remote_path (str): Directory of the file on the FTP server
+        filename (str): Name of the file to download
+        local_dir (Path): Directory to save the downloaded file
+        unzip (bool): Decompress a .gz file while it is received, so only the extracted file is written
+        checksum (BSDSum, optional): Checksum to update with the received (compressed) bytes
+        local_name (str, optional): Name to save the file under, defaults to the remote name
+        blocksize (int): Size of each read from the data connection and of the write buffer
+        expected_size (int, optional): Size of the remote file as listed, checked against the bytes received
+    
+    Returns:
+        bool: True if the file was downloaded, False otherwise
+    """
+    unzip = unzip and filename.endswith('.gz')
+    if not local_name:
+        local_name = filename[:-len('.gz')] if unzip else filename
+    local_path = os.path.join(local_dir, local_name)
+    # write to a temporary file so an interrupted transfer is never taken for a complete one
+    part_path = local_path + '.part'
+    received = 0
     try:
+        with open(part_path, 'wb', buffering=blocksize) as f:
+            out = GunzipWriter(f) if unzip else f
+            def write(chunk):
+                nonlocal received
+                out.write(chunk)
+                if checksum:
+                    checksum.update(chunk)
+                received += len(chunk)
+            for attempt in range(max_retries):
+                try:
+                    # resume after the bytes already received, the decompressor and checksum carry on from there
+                    retrieve(ftp, f'{remote_path}/{filename}', write, rest=received or None, blocksize=blocksize)
+                    break
+                except ftplib.error_perm:
+                    raise
+                except ftplib.all_errors as e:
+                    if attempt == max_retries - 1:
+                        raise
+                    rate_limiter.backoff()
+                    delay = 2 ** attempt
+                    logging.warning(f"Attempt {attempt + 1} to download {filename} failed after {received} bytes: {e}. Resuming in {delay}s")
+                    time.sleep(delay)
+                    # the reply to the aborted transfer may still be pending, which a NOOP would
+                    # read as its own, REST is only sent on a fresh control connection
+                    reconnect(ftp)
+            if expected_size is not None and received != expected_size:
+                raise EOFError(f"Received {received} of {expected_size} bytes")
+            if unzip:
+                out.close()
+        os.replace(part_path, local_path)
+        rate_limiter.relax()
+        logging.info(f"Successfully downloaded: {filename}")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to download {filename}: {str(e)}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return False
+    
+def download_file_parallel(ftp, remote_path, filename, local_dir, streams, max_retries=3, blocksize=BLOCK_SIZE):
+    """
+    Download a file over several FTP connections at once, each retrieving one byte range
+    
+    Parallel streams are not held back by the congestion window of a single TCP
+    connection, which helps on long-distance links. The ranges are written in
+    place into a preallocated file, so unlike download_file the data cannot be
+    decompressed while it is received.
+    
+    Args:
+        ftp (ftplib.FTP): Active FTP connection object, used to query the file size
+        remote_path (str): Directory of the file on the FTP server
+        filename (str): Name of the file to download
+        local_dir (Path): Directory to save the downloaded file
+        streams (int): Number of connections, each retrieving an equal byte range
+        blocksize (int): Size of each read from the data connections
+    
+    Returns:
+        bool: True if the file was downloaded, False otherwise
+    """
+    remote_file = f'{remote_path}/{filename}'
+    local_path = os.path.join(local_dir, filename)
+    part_path = local_path + '.part'
+    
+    def fetch_range(fd, start, end):
+        """Retrieve bytes start to end of the file with REST, on a connection of its own"""
+        offset = start
         for attempt in range(max_retries):
-            with open(local_path, 'wb') as f:
-                ftp.retrbinary(f'RETR {remote_path}/{filename}', f.write)
-            logging.info(f"Successfully downloaded: {filename}")
-            return True
+            range_ftp = create_ftp_connection(ftp.host)
+            if not range_ftp:
+                continue
+            try:
+                range_ftp.voidcmd('TYPE I')
+                buffer = bytearray(blocksize)
+                with range_ftp.transfercmd(f'RETR {remote_file}', offset) as conn:
+                    while offset < end:
+                        size = conn.recv_into(buffer, min(blocksize, end - offset))
+                        if not size:
+                            raise EOFError(f"Connection closed at byte {offset} of {end}")
+                        os.pwrite(fd, memoryview(buffer)[:size], offset)
+                        offset += size
+                # the server is left mid transfer for all but the last range, so the connection is dropped
+                range_ftp.close()
+                return
+            except ftplib.error_perm:
+                range_ftp.close()
+                raise
+            except ftplib.all_errors as e:
+                range_ftp.close()
+                if attempt == max_retries - 1:
+                    raise
+                rate_limiter.backoff()
+                logging.warning(f"Attempt {attempt + 1} to download bytes {start}-{end} of {filename} failed at byte {offset}: {e}")
+                time.sleep(2 ** attempt)
+        raise ConnectionError(f"Could not connect to {ftp.host}")
+    
+    try:
+        ftp.voidcmd('TYPE I')
+        size = ftp.size(remote_file)
+        bounds = [size * i // streams for i in range(streams + 1)]
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        try:
+            if hasattr(os, 'posix_fallocate') and size:
+                os.posix_fallocate(fd, 0, size)
+            with ThreadPoolExecutor(max_workers=streams) as executor:
+                # list() re-raises the first error of any range
+                list(executor.map(partial(fetch_range, fd), bounds[:-1], bounds[1:]))
+        finally:
+            os.close(fd)
+        os.replace(part_path, local_path)
+        rate_limiter.relax()
+        logging.info(f"Successfully downloaded: {filename} over {streams} connections")
+        return True
     except Exception as e:
         logging.error(f"Failed to download {filename}: {str(e)}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
     return False
+
+def list_species(ftp, division, release, use_cache=True):
+    """List the species directories of a release, reusing a copy on disk younger than CACHE_TTL"""
+    cache_file = CACHE_DIR / f'{division}_{release}_fasta.json'
+    if use_cache:
+        try:
+            if time.time() - cache_file.stat().st_mtime < CACHE_TTL:
+                return json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            pass
     
-def fetch_ensembl_species(ftp, species_list_file, search_term, division, release):
+    listing, ftp_path = get_ftp_files(ftp, division, release, '', 'fasta', '/dna/')
+    species_list = list(listing)
+    if species_list:
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # write aside and rename, so concurrent runs never read a partial file
+            tmp_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}')
+            tmp_file.write_text(json.dumps(species_list))
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            logging.warning(f"Could not cache the species list in {cache_file}: {e}")
+    return species_list
+
+def download_file_lftp(ftp, remote_path, filename, local_dir, streams):
+    """
+    Download a file with lftp, which splits it over several connections itself (pget)
+    
+    Args:
+        ftp (ftplib.FTP): Active FTP connection object, only its host and port are used
+        remote_path (str): Directory of the file on the FTP server
+        filename (str): Name of the file to download
+        local_dir (Path): Directory to save the downloaded file
+        streams (int): Number of connections opened by pget
+    
+    Returns:
+        bool: True if the file was downloaded, False otherwise
+    """
+    local_path = os.path.join(local_dir, filename)
+    part_path = local_path + '.part'
+    # -c resumes a .part left by an interrupted run
+    script = (f"set net:max-retries 3; open -p {ftp.port} {shlex.quote(ftp.host)}; "
+              f"pget -c -n {streams} -o {shlex.quote(part_path)} {shlex.quote(f'{remote_path}/{filename}')}")
+    result = subprocess.run(['lftp', '-c', script], capture_output=True, text=True)
+    if result.returncode != 0:
+        logging.error(f"Failed to download {filename} with lftp (code: {result.returncode}): {result.stderr.strip()}")
+        return False
+    os.replace(part_path, local_path)
+    logging.info(f"Successfully downloaded: {filename} with lftp")
+    return True
+
+def fetch_ensembl_species(ftp, species_list_file, search_term, division, release, use_cache=True):
     """
     Fetch list of available species from Ensembl FTP server based on search criteria
     
@@ -69,11 +540,12 @@ def fetch_ensembl_species(ftp, species_list_file, search_term, division, release
         species_list_file (str): Path to output file where species list will be saved
         search_term (str): Term to filter species names ('all' to get all species)
         release (str, optional): Ensembl release number. 
+        use_cache (bool): Reuse the species listing cached on disk by a recent run
     
     Returns:
         list: List of species names matching the search criteria or all
     """
-    species_list, ftp_path = get_ftp_files(ftp, division, release, '', 'fasta', '/dna/')
+    species_list = list_species(ftp, division, release, use_cache)
     #filter by given species
     if search_term!='all':
         species_list = [x for x in species_list if search_term.lower() in x.lower()]
@@ -88,101 +560,236 @@ def fetch_ensembl_species(ftp, species_list_file, search_term, division, release
     # Change back to root FTP directory
     return species_list
 
-def linux_sum(file_path):
-    result = subprocess.run(["sum", file_path], capture_output=True, text=True)
-    return result.stdout.strip().split()[0]  # Extract the first column
+def get_checksums(ftp, ftp_path):
+    """
+    Retrieve and parse the CHECKSUMS file of an Ensembl FTP directory
+    
+    Returns:
+        dict: BSD checksum of each file keyed by file name
+    """
+    if ftp_path in ftp.checksums_cache:
+        return ftp.checksums_cache[ftp_path]
+    lines = []
+    try:
+        ftp.retrlines(f'RETR {ftp_path}/CHECKSUMS', lines.append)
+    except Exception as e:
+        logging.error(f"Failed to retrieve CHECKSUMS: {e}")
+        return {}
+    # each line is "<checksum> <blocks> <file path>"
+    checksums = {fields[2].rsplit('/', 1)[-1]: fields[0] for fields in map(str.split, lines) if len(fields) > 2}
+    ftp.checksums_cache[ftp_path] = checksums
+    return checksums
 
+def bsd_sum(data, checksum=0):
+    """Update a BSD checksum (16-bit rotate and add, as computed by `sum`) with data"""
+    for byte in data:
+        checksum = ((checksum >> 1) + ((checksum & 1) << 15) + byte) & 0xFFFF
+    return checksum
 
-def get_genome(species, server, file_types, division, release, force_replace, dna_file_ext, output_dir):
+class BSDSum:
+    """
+    Incremental BSD checksum, as listed in Ensembl CHECKSUMS files
     
-    # Add random delay before starting download
-    delay = random.uniform(1, 3)
-    time.sleep(delay)
-    logging.info(f"\nProcessing {species} (after {delay:.1f}s delay)...")
+    Each instance still starts its own `sum` process when it is available, the
+    data is piped into it while it is downloaded or decompressed instead of the
+    file being read back from disk afterwards. The pure-Python bsd_sum is only
+    used as a fallback since it is much slower on multi-GB genome files.
+    """
+    def __init__(self):
+        self._checksum = 0
+        self._proc = None
+        if shutil.which("sum"):
+            self._proc = subprocess.Popen(["sum"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def update(self, chunk):
+        if self._proc:
+            self._proc.stdin.write(chunk)
+        else:
+            self._checksum = bsd_sum(chunk, self._checksum)
+
+    def digest(self):
+        if self._proc:
+            out, _ = self._proc.communicate()
+            return out.decode().strip().split()[0]  # Extract the first column
+        return f"{self._checksum:05d}"
+
+def unzip_file(gz_file, extracted_file, expected_checksum):
+    """
+    Decompress a local .gz file, computing its BSD checksum in the same read pass
     
-    # Connect to FTP server
-    ftp = create_ftp_connection(server)
-    if not ftp:
-        return None
+    Args:
+        gz_file (Path): Compressed file to read
+        extracted_file (Path): Destination of the decompressed data
+        expected_checksum (str): Checksum listed in the CHECKSUMS file, None to skip the verification
     
-    release_dir = release
-    if release!='current':
-        release_dir = 'release-' + release
-    output_dir = Path(output_dir) / division / species / release_dir
-    output_dir.mkdir(parents=True, exist_ok=True)
+    Returns:
+        bool: True if the checksum matched and the file was extracted, False otherwise,
+            in which case the .gz is only kept after a local error
+    """
+    checksum = BSDSum()
+    part_file = extracted_file.with_name(extracted_file.name + '.part')
+    try:
+        with open(gz_file, 'rb') as f_in, open(part_file, 'wb', buffering=BLOCK_SIZE) as f_out:
+            # reserve the space up front so the filesystem does not allocate blocks piecemeal,
+            # best effort only: the size in the trailer is 0 for an empty file or a multiple of 4 GiB
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    size = gz_uncompressed_size(gz_file)
+                    if size:
+                        os.posix_fallocate(f_out.fileno(), 0, size)
+                except OSError:
+                    pass
+            writer = GunzipWriter(f_out)
+            for chunk in iter(lambda: f_in.read(BLOCK_SIZE), b''):
+                checksum.update(chunk)
+                writer.write(chunk)
+            writer.close()
+            f_out.truncate()
+    except (zlib.error, EOFError) as e:
+        # the downloaded data is corrupt, it has to be downloaded again
+        logging.error(f"Failed to unzip {gz_file.name}, removing it: {e}")
+        checksum.digest()
+        part_file.unlink(missing_ok=True)
+        gz_file.unlink()
+        return False
+    except OSError as e:
+        # a local error (e.g. a full disk), the download itself is kept
+        logging.error(f"Failed to unzip {gz_file.name}, keeping it: {e}")
+        checksum.digest()
+        part_file.unlink(missing_ok=True)
+        return False
+    
+    file_checksum = checksum.digest()
+    if expected_checksum is not None and file_checksum != expected_checksum:
+        logging.info(f"Removing {gz_file} file since the checksums don't match {file_checksum} != {expected_checksum}")
+        part_file.unlink()
+        gz_file.unlink()
+        return False
+    os.replace(part_file, extracted_file)
+    gz_file.unlink()
+    logging.info(f"Successfully unzipped {gz_file.name}")
+    return True
+
+
+def get_file(species, file_type, ftp_pool, division, release, force_replace, dna_file_ext, output_dir, assembly=None,
+             blocksize=BLOCK_SIZE, streams=1, existing=None, backend='python'):
+    """
+    Download, verify and extract one file type (fasta or gtf) of a species
+    
+    When the assembly is known the fasta file name is predictable, so it is probed
+    directly and the species directory is only listed if the probe misses.
+    existing maps the names of the files already in output_dir to their
+    os.DirEntry, it is scanned here if not given. With the lftp backend the
+    .gz is transferred by lftp and then verified and unzipped locally.
+    
+    Returns:
+        Path: Path to the extracted file, None if no file was downloaded
+    """
+    if existing is None:
+        existing = {entry.name: entry for entry in os.scandir(output_dir)}
     file_types_ext = {'fasta': dna_file_ext, 'gtf': 'gtf.gz'}
     file_types_extra = {'fasta': '/dna/', 'gtf': ''}
-    download_files = []
-    for file_type in file_types:
-        file_list, ftp_path = get_ftp_files(ftp, division, release, species.lower(), file_type, file_types_extra[file_type])
+    # Borrow an FTP connection from the pool
+    with ftp_pool.acquire() as ftp:
+        if not ftp:
+            return None
+        
+        file_list = {}
+        if assembly and file_type == 'fasta':
+            ftp_path = ftp_dir_path(division, release, species.lower(), file_type, file_types_extra[file_type])
+            file_list = probe_ftp_file(ftp, ftp_path, f'{species.lower().capitalize()}.{assembly}.{dna_file_ext}')
+        if not file_list:
+            file_list, ftp_path = get_ftp_files(ftp, division, release, species.lower(), file_type, file_types_extra[file_type])
         # Download DNA sequence file
-        #file_ext = f"{species}.*.{file_types_ext[file_type]}"
-        matches = [f for f in file_list if f.endswith(file_types_ext[file_type]) and 'abinitio' not in f]
+        file_ext = file_types_ext[file_type]
+        matches = [f for f, facts in file_list.items()
+                   if f.endswith(file_ext) and 'abinitio' not in f and facts.get('type') != 'dir']
         if not matches:
             logging.warning(f"{file_type} file not found for {species.lower()}")
-            continue
-        
-        # Get checksum for the file
-        try:
-            ftp.cwd(ftp_path)
-            checksums = {}
-            ftp.retrlines('RETR CHECKSUMS', lambda x: checksums.update({x.split()[2].split('/')[-1]: x.split()[0]}) if len(x.split()) > 2 else None)
-            #x[2].split('/')[-1].endswith(file_types_ext[file_type])
-        except Exception as e:
-            logging.error(f"Failed to change directory or retrieve CHECKSUMS: {e}")
-            checksums = {}
+            return None
         
         gz_file = output_dir / matches[0]
         if matches[0].endswith('.gz'):
             unzipped_file = matches[0].replace('.gz', '')
         extracted_file = output_dir / unzipped_file
-        download = True
-        if not extracted_file.exists() or force_replace:
-            if gz_file.exists():
-                try:
-                    file_checksum = linux_sum(gz_file)
-                    if file_checksum == checksums[matches[0]]:
-                        download = False
-                    else:
-                        logging.info(f"Removing existing {gz_file} file and downloading again since the checksums don't match {file_checksum} != {checksums[matches[0]]}")
-                        gz_file.unlink()
-                except KeyError:
-                    logging.error(f"No Checksum exists for {matches[0]}")
-                
-            if download or force_replace:
-                logging.info(f"Downloading {ftp_path}{matches[0]}")
-                download_file(ftp, ftp_path, matches[0], output_dir)
-                download_file(ftp, ftp_path, 'README', output_dir)
-                readme_file = output_dir / 'README'
-                if readme_file.exists():
-                    readme_file.rename(output_dir / f'{file_type}_README')
-                download = True
-            
-                if matches[0] in checksums.keys() and download:
-                    #file_hash = hashlib.md5(f.read()).hexdigest()
-                    file_hash = linux_sum(gz_file)
-                    print('file_hash: ', file_hash, checksums[matches[0]])
-                    if file_hash != checksums[matches[0]]:
-                        logging.error(f"Checksum verification failed for {matches[0]}")
-                        gz_file.unlink()
-                        continue
-                    else:
-                        logging.info(f"Checksum verification passed for {matches[0]}")
-            
-            if gz_file.exists():
-                try:
-                    with gzip.open(str(gz_file), 'rb') as gz_in:
-                        with open(str(extracted_file), 'wb') as f_out:
-                            f_out.write(gz_in.read())
-                    gz_file.unlink()
-                    logging.info(f"Successfully unzipped {matches[0]}")
-                    download_files.append(extracted_file)
-                except Exception as e:
-                    logging.error(f"Failed to unzip {matches[0]}: {e}")
-        else:
+        if unzipped_file in existing and not force_replace:
             logging.info(f"File already exists {extracted_file}")
+            return None
+        
+        # Get checksum for the file, only needed once a file is going to be verified
+        checksums = get_checksums(ftp, ftp_path)
+        
+        # the listing gives the size of the file, None when the server only supports NLST
+        remote_size = file_list[matches[0]].get('size')
+        remote_size = int(remote_size) if remote_size else None
+        # a verified .gz left over from an earlier run is unzipped instead of downloaded again
+        if matches[0] in existing and not force_replace:
+            if remote_size is not None and existing[matches[0]].stat().st_size != remote_size:
+                # a partial file, no need to read it all to compute its checksum
+                logging.info(f"Removing existing {gz_file} file since its size differs from the remote file")
+                gz_file.unlink()
+            elif matches[0] not in checksums:
+                logging.error(f"No Checksum exists for {matches[0]}")
+            elif unzip_file(gz_file, extracted_file, checksums[matches[0]]):
+                return extracted_file
+            elif gz_file.exists():
+                # a local error kept the .gz, downloading it again would overwrite it
+                return None
+        
+        logging.info(f"Downloading {ftp_path}{matches[0]}")
+        if backend == 'lftp' or streams > 1:
+            # parallel byte ranges land in a local .gz, which is then verified and unzipped in one pass
+            if backend == 'lftp':
+                downloaded = download_file_lftp(ftp, ftp_path, matches[0], output_dir, streams)
+            else:
+                downloaded = download_file_parallel(ftp, ftp_path, matches[0], output_dir, streams, blocksize=blocksize)
+            download_file(ftp, ftp_path, 'README', output_dir, local_name=f'{file_type}_README')
+            if downloaded and unzip_file(gz_file, extracted_file, checksums.get(matches[0])):
+                return extracted_file
+            return None
+        
+        # decompress and checksum while downloading, the .gz is never written to disk
+        checksum = BSDSum()
+        downloaded = download_file(ftp, ftp_path, matches[0], output_dir, unzip=True, checksum=checksum,
+                                   blocksize=blocksize, expected_size=remote_size)
+        file_hash = checksum.digest()
+        download_file(ftp, ftp_path, 'README', output_dir, local_name=f'{file_type}_README')
+        if not downloaded:
+            return None
+        
+        if matches[0] in checksums.keys():
+            logging.debug('Checksum of %s: %s, expected %s', matches[0], file_hash, checksums[matches[0]])
+            if file_hash != checksums[matches[0]]:
+                logging.error(f"Checksum verification failed for {matches[0]}")
+                extracted_file.unlink()
+                return None
+            else:
+                logging.info(f"Checksum verification passed for {matches[0]}")
+        return extracted_file
+    return None
+
+def get_genome(species, ftp_pool, file_types, division, release, force_replace, dna_file_ext, output_dir, assembly=None,
+               blocksize=BLOCK_SIZE, streams=1, backend='python'):
+    
+    # Only wait before starting when the server has been throttling us
+    rate_limiter.acquire()
+    logging.info(f"Processing {species}...")
+    
+    release_dir = release
+    if release!='current':
+        release_dir = 'release-' + release
+    output_dir = Path(output_dir) / division / species / release_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # one directory scan for all file types instead of a stat per candidate file
+    existing = {entry.name: entry for entry in os.scandir(output_dir)}
+    # transfer all file types of the species at the same time, each over its own pooled connection
+    fetch = partial(get_file, species, ftp_pool=ftp_pool, division=division, release=release, force_replace=force_replace,
+                    dna_file_ext=dna_file_ext, output_dir=output_dir, assembly=assembly,
+                    blocksize=blocksize, streams=streams, existing=existing,
+                    backend=backend)
+    with ThreadPoolExecutor(max_workers=len(file_types)) as executor:
+        download_files = [f for f in executor.map(fetch, file_types) if f]
     
-    ftp.quit()
     return download_files
 
 def main():
@@ -199,8 +806,11 @@ def main():
     parser.add_argument("-d", "--download_species", action='store_true', default=False,
                         help="Download species available in NCBI")
     parser.add_argument("-fr", "--force_replace", action='store_true', default=False,
-                        help="Download and replace existing files even if it exists, especially useful to update current release")
+                        help="Download and replace existing files even if it exists, especially useful to update current release. "
+                             "The cached species list is refreshed as well")
     parser.add_argument('-fe', '--dna_file_ext', default='dna_sm.toplevel.fa.gz', help='file extension for dna fasta files default dna_sm.toplevel.fa.gz')
+    parser.add_argument('-a', '--assembly', default=None,
+                        help='Assembly name (e.g. GRCh38), lets the fasta file be checked directly instead of listing the species directory')
     parser.add_argument('-div', '--division', choices=['primates', 'plants', 'fungi', 'bacteria', 'protists', 'metazoa'],
                       default='primates', help='Ensembl division')
     parser.add_argument('-ft', '--file_types', choices=['fasta', 'gtf'], nargs="+",
@@ -208,12 +818,22 @@ def main():
     parser.add_argument("--species_list_file", default="ensembl_species_list.txt", 
                         help="File name to save the list of species names.")
     parser.add_argument("-p", "--processes", type=int, default=1,
-                        help="Number of parallel downloads (default: 1)")
+                        help="Number of species downloaded in parallel threads (default: 1)")
+    parser.add_argument("-bs", "--blocksize", type=int, default=BLOCK_SIZE,
+                        help=f"Bytes read from the FTP data connection at a time (default: {BLOCK_SIZE})")
+    parser.add_argument("--streams", type=int, default=1,
+                        help="FTP connections used to download each genome file in parallel byte ranges, "
+                             "the compressed file is then kept on disk until it is unzipped (default: 1)")
+    parser.add_argument("--backend", choices=['python', 'lftp'], default='python',
+                        help="Tool transferring the genome files, lftp uses --streams connections per file (default: python)")
     parser.add_argument('-o', '--output', default='ensembl_genomes', help='Output directory')
     
     args = parser.parse_args()
 
     setup_logging()
+    if args.backend == 'lftp' and not shutil.which('lftp'):
+        logging.warning("lftp is not installed, downloading with the python backend")
+        args.backend = 'python'
     
     # Determine the appropriate FTP server
     server = "ftp.ensembl.org" if args.division == "primates" else "ftp.ensemblgenomes.org"
@@ -228,34 +848,56 @@ def main():
     if args.species:
         species_list = args.species
     elif args.file and os.path.isfile(args.file):
-        species_list = [line.strip() for line in open(args.file, 'r').readlines() if line.strip() if line!=""]
+        with open(args.file, 'r') as species_file:
+            species_list = [name for name in (line.strip() for line in species_file) if name]
     elif args.search_term:
-        species_list = fetch_ensembl_species(ftp, args.species_list_file, args.search_term, division=args.division, release=args.release)
+        species_list = fetch_ensembl_species(ftp, args.species_list_file, args.search_term, division=args.division, release=args.release,
+                                             use_cache=not args.force_replace)
     elif args.download_species:
-        species_list = fetch_ensembl_species(ftp, args.species_list_file, search_term='all', division=args.division, release=args.release)
+        species_list = fetch_ensembl_species(ftp, args.species_list_file, search_term='all', division=args.division, release=args.release,
+                                             use_cache=not args.force_replace)
     else:
         logging.error("Please provide either \na) a list of species\nb) a file containing species names or\n c) a search term.")
     
-    ftp.quit()
-
+    # drop duplicated species, keeping the input order, so they are not downloaded twice
+    species_list = list(dict.fromkeys(species_list))
     if not species_list:
+        ftp.quit()
         return []
     if args.search_term=='all' and not args.download_species:
+        ftp.quit()
         sys.exit(0)
     # Create output directory
     output_dir = Path(args.output)
     # Process species in parallel
-    results = []
-    if args.processes>1:
-        logging.info(f'Downloading {len(species_list)} species using {args.processes} threads.')
-        with Pool(processes=args.processes) as pool:
-            results = pool.starmap(get_genome, [(species, server, args.file_types, args.division, args.release, 
-                                                 args.force_replace, args.dna_file_ext, args.output) for species in species_list])
-    else:
-        for species in species_list:
-            results.append(get_genome(species, server, args.file_types, args.division, 
-                                      args.release, args.force_replace, args.dna_file_ext, args.output))
+    # one reusable control connection per worker and file type
+    # the connection used for listing species is reused instead of logging in again
+    ftp_pool = FTPPool(server, args.processes * len(args.file_types), ftp=ftp)
+    logging.info(f'Downloading {len(species_list)} species using {args.processes} threads.')
+    # downloads are I/O bound: threads share the connection pool in-process, nothing is forked or pickled
+    fetch = partial(get_genome, ftp_pool=ftp_pool, file_types=args.file_types, division=args.division, release=args.release,
+                    force_replace=args.force_replace, dna_file_ext=args.dna_file_ext, output_dir=args.output,
+                    assembly=args.assembly, blocksize=args.blocksize,
+                    streams=args.streams, backend=args.backend)
+    try:
+        with ThreadPoolExecutor(max_workers=args.processes) as executor:
+            futures = {executor.submit(fetch, species): species for species in species_list}
+            # report progress as species finish, not in submission order
+            failed = set()
+            for done, future in enumerate(as_completed(futures), 1):
+                error = future.exception()
+                if error is not None:
+                    # one species failing does not stop the others
+                    failed.add(future)
+                    logging.error(f"Failed {futures[future]} ({done}/{len(futures)}): {error!r}")
+                else:
+                    logging.info(f"Finished {futures[future]} ({done}/{len(futures)})")
+            results = [future.result() for future in futures if future not in failed]
+    finally:
+        ftp_pool.close()
     logging.info(f"Downloaded files for {len(results)} species.")
+    if failed:
+        logging.error(f"Failed to download {len(failed)} species: {', '.join(species for future, species in futures.items() if future in failed)}")
     
     return results
 
@@ -1,15 +1,55 @@
 #!/usr/bin/env python3
 import os
-import json
+import mmap
 import time
+import zlib
+import shlex
 import random
+import shutil
+import struct
+import sqlite3
 import zipfile
 import hashlib
 import logging
 import argparse
+import tempfile
 import subprocess
 from pathlib import Path
-from multiprocessing import Pool
+from functools import partial, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+try:
+    # faster parser for the JSON written by datasets, e.g. thousands of summary lines and the dataset catalogs
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# read/write size when extracting zip members, zipfile copies in 64 KiB pieces by default
+COPY_SIZE = 4 << 20
+# resolved once instead of searching PATH on every call, the bare name is kept so a missing tool still errors at call time
+DATASETS_BIN = shutil.which('datasets') or 'datasets'
+# lowercase fragments of datasets errors that mean NCBI is throttling requests
+RATE_LIMIT_MARKERS = ('429', '503', 'too many requests', 'rate limit', 'service unavailable')
+# quotes and brackets dropped from NCBI organism names in a single str.translate pass
+NAME_CLEANUP = str.maketrans('', '', "'[]")
+# species already downloaded into an output directory, looked up before any dataset catalog is parsed
+INDEX_NAME = '.index.sqlite3'
+# lowercased fileType of the dataset catalog for each datasets --include type, the others have the same name
+CATALOG_FILE_TYPES = {'genome': 'genomic_nucleotide_fasta', 'fasta': 'genomic_nucleotide_fasta',
+                      'rna': 'rna_nucleotide_fasta', 'protein': 'protein_fasta', 'cds': 'cds_nucleotide_fasta',
+                      'gbff': 'genbank_flat_file', 'seq-report': 'sequence_report'}
+
+class MappedArchive(mmap.mmap):
+    """Read-only memory map usable as the file object of a zipfile.ZipFile"""
+    def seekable(self):
+        # zipfile checks for it, mmap only provides it from Python 3.13 on
+        return True
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        # zipfile expects a file's OSError when probing for the end record of a file that is too short
+        try:
+            return super().seek(pos, whence)
+        except ValueError as e:
+            raise OSError(str(e)) from e
 
 def setup_logging():
     """Configure logging settings"""
@@ -32,47 +72,240 @@ def validate_checksum(file_path, expected_md5):
     if not file_path.exists():
         return False
         
-    md5_hash = hashlib.md5()
     with open(file_path, 'rb') as f:
-        # Read file in chunks to handle large files efficiently
-        for chunk in iter(lambda: f.read(4096), b''):
+        if hasattr(hashlib, 'file_digest'):
+            # hashes in large blocks reading straight into a buffer, without a Python loop
+            return hashlib.file_digest(f, 'md5').hexdigest() == expected_md5
+        # file_digest is only available from Python 3.11 on
+        md5_hash = hashlib.md5()
+        for chunk in iter(lambda: f.read(COPY_SIZE), b''):
             md5_hash.update(chunk)
-    return md5_hash.hexdigest() == expected_md5
+        return md5_hash.hexdigest() == expected_md5
 
-def get_file_paths(dataset_catalog, file_types):
+def copy_stored_member(archive_fd, mapped, member, target):
+    """
+    Extract an uncompressed (stored) zip member with copy_file_range
     
-    if not dataset_catalog.exists():
-        return {}
-    with open(dataset_catalog, 'r') as json_file:
-        species_accession = json.load(json_file)
-        files_index = None
-        for index, element in enumerate(species_accession['assemblies']):
+    The kernel copies the data between the two files, it is only read from
+    the memory map to compute the checksums.
+    
+    Returns:
+        str: MD5 hex digest of the member
+    """
+    # the data follows the local file header, whose extra field can differ from the central directory's
+    signature, = struct.unpack_from('<4s', mapped, member.header_offset)
+    if signature != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local file header for {member.filename}")
+    name_length, extra_length = struct.unpack_from('<HH', mapped, member.header_offset + 26)
+    start = member.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+    with memoryview(mapped)[start:start + member.file_size] as data:
+        if zlib.crc32(data) != member.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {member.filename}")
+        md5_hash = hashlib.md5(data)
+        with open(target, 'wb') as dst:
             try:
-                list(element.keys()).index('accession')
-                files_index = index
-                break
-            except ValueError:
+                copied = 0
+                while copied < member.file_size:
+                    size = os.copy_file_range(archive_fd, dst.fileno(), member.file_size - copied, start + copied, copied)
+                    if not size:
+                        raise OSError(f"copy_file_range stopped at byte {copied} of {member.file_size}")
+                    copied += size
+            except (AttributeError, OSError):
+                # not available on this platform or across these filesystems, write from the mapping instead
+                dst.seek(0)
+                dst.write(data)
+                dst.truncate()
+    return md5_hash.hexdigest()
+
+def extract_zip(zip_file, extract_path):
+    """
+    Extract a zip archive, computing the MD5 of each member while it is written
+    
+    The extracted files are then validated without reading them back from disk.
+    
+    Args:
+        zip_file (Path): Archive to extract
+        extract_path (Path): Directory the members are extracted to
+    
+    Returns:
+        dict: MD5 hex digest of each extracted file keyed by its name in the archive
+    
+    Raises:
+        zipfile.BadZipFile: If the archive could not be extracted
+    """
+    extract_root = extract_path.resolve()
+    if os.path.getsize(zip_file) == 0:
+        raise zipfile.BadZipFile(f"File is empty: {zip_file}")
+    # members are read out of the mapped archive instead of through a read() syscall per block,
+    # zipfile serialises the seeks of the threads below on the shared mapping
+    with open(zip_file, 'rb') as f, MappedArchive(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+            zipfile.ZipFile(mapped, 'r') as zip_ref:
+        targets = []
+        for member in zip_ref.infolist():
+            target = (extract_root / member.filename).resolve()
+            # never write outside of the extraction directory
+            if not target.is_relative_to(extract_root):
+                raise zipfile.BadZipFile(f"Member outside of the archive root: {member.filename}")
+            if member.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
                 continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            targets.append((member, target))
+        
+        def extract_member(member, target):
+            if member.compress_type == zipfile.ZIP_STORED and not member.flag_bits & 0x1:
+                # no inflate needed, skip the copy through user space (unless the member is encrypted)
+                return member.filename, copy_stored_member(f.fileno(), mapped, member, target)
+            md5_hash = hashlib.md5()
+            with zip_ref.open(member) as src, open(target, 'wb', buffering=COPY_SIZE) as dst:
+                for chunk in iter(lambda: src.read(COPY_SIZE), b''):
+                    md5_hash.update(chunk)
+                    dst.write(chunk)
+            return member.filename, md5_hash.hexdigest()
+        
+        # zlib and md5 release the GIL, so the fasta and gtf members are decompressed side by side
+        with ThreadPoolExecutor(max_workers=min(8, len(targets)) or 1) as executor:
+            # dict() re-raises the first error of any member
+            return dict(executor.map(lambda item: extract_member(*item), targets))
+
+def read_md5sums(md5_path):
+    """
+    Parse an md5sum.txt file
+    
+    Returns:
+        dict: MD5 hex digest keyed by the last two components of each path, e.g. {accession}/{file name}
+    """
+    md5_hashes = {}
+    with open(md5_path, 'r') as md5_file:
+        for line in md5_file:
+            if not line.strip():
+                continue
+            digest, path = line.split(None, 1)
+            md5_hashes['/'.join(path.strip().rsplit('/', 2)[-2:])] = digest
+    return md5_hashes
+
+@lru_cache(maxsize=256)
+def load_catalog_assembly(catalog_path, mtime_ns, size):
+    """
+    Parse a dataset_catalog.json and return its assembly entry, None if it has none
+    
+    The modification time and size are part of the cache key, so an archive
+    extracted again over the catalog is parsed again.
+    """
+    species_accession = json_loads(Path(catalog_path).read_bytes())
+    # the genome files are listed under the assembly that has an accession, the others hold e.g. the data report
+    return next((element for element in species_accession['assemblies'] if 'accession' in element), None)
+
+def get_file_paths(dataset_catalog, file_types):
+    
+    try:
+        stat = dataset_catalog.stat()
+    except FileNotFoundError:
+        return {}
+    assembly = load_catalog_assembly(str(dataset_catalog), stat.st_mtime_ns, stat.st_size)
+    if assembly is None:
+        return {}
     
     base_dir = dataset_catalog.parent
+    catalog_file_types = {CATALOG_FILE_TYPES.get(file_type, file_type) for file_type in file_types}
     files = {}
-    for file in species_accession['assemblies'][files_index]['files']:
+    for file in assembly['files']:
         #only check required files
         file_type = file['fileType'].lower()
-        if 'fasta' not in file_type and file_type not in file_types:
+        if 'fasta' not in file_type and file_type not in catalog_file_types:
             continue
         if (base_dir / file['filePath']).exists():    
             files[file_type] = file['filePath']
     
-    for u_file_type in file_types:
-        if u_file_type not in files.keys() and 'fasta' not in u_file_type:
-            logging.warn(f'No file was found for {u_file_type}')
-            continue
+    for u_file_type in missing_file_types(files, file_types):
+        logging.warning(f'No file was found for {u_file_type}')
         
 
     return files
     
-def download_genome(species, output_dir, max_retries=3, file_types=['genome', 'gtf']):
+def missing_file_types(files, file_types):
+    """
+    List the requested file types that have no file in the output of get_file_paths
+    
+    The --include types are looked up under their catalog fileType, see CATALOG_FILE_TYPES.
+    """
+    return [file_type for file_type in file_types if CATALOG_FILE_TYPES.get(file_type, file_type) not in files]
+
+def catalog_path(output_dir, species):
+    """Path of the dataset_catalog.json of a species downloaded into output_dir"""
+    return output_dir / species.replace(" ", "_") / "ncbi_dataset" / "data" / "dataset_catalog.json"
+
+def open_index(output_dir):
+    """
+    Open (and create if needed) the SQLite index of downloaded species of an output directory
+    
+    The default rollback journal is kept, WAL relies on shared memory that does not work on
+    network filesystems (NFS, Lustre), and the index is only written once per run anyway.
+    
+    Raises:
+        sqlite3.Error: If the index cannot be opened, e.g. read-only directory, locked or corrupt file
+    """
+    index = sqlite3.connect(output_dir / INDEX_NAME)
+    try:
+        # version 1 added the files column, rows of older indices are recorded again
+        if index.execute('PRAGMA user_version').fetchone()[0] < 1:
+            with index:
+                index.execute('DROP TABLE IF EXISTS downloads')
+                index.execute('CREATE TABLE downloads (species TEXT, file_types TEXT, mtime_ns INTEGER, files TEXT, '
+                              'PRIMARY KEY (species, file_types))')
+                index.execute('PRAGMA user_version = 1')
+    except sqlite3.Error:
+        index.close()
+        raise
+    return index
+
+def indexed_species(index, output_dir, species_list, file_types):
+    """
+    Find the species recorded as downloaded whose dataset catalog has not changed since
+    and whose files are all still there
+    
+    A stat per file replaces opening and parsing the catalog.
+    
+    Returns:
+        set: Species that do not need to be downloaded again
+    """
+    recorded = {species: (mtime_ns, files) for species, mtime_ns, files in
+                index.execute('SELECT species, mtime_ns, files FROM downloads WHERE file_types = ?',
+                              (','.join(sorted(file_types)),))}
+    done = set()
+    for species in species_list:
+        if species not in recorded:
+            continue
+        mtime_ns, files = recorded[species]
+        dataset_catalog = catalog_path(output_dir, species)
+        try:
+            if dataset_catalog.stat().st_mtime_ns != mtime_ns:
+                continue
+        except FileNotFoundError:
+            continue
+        # files deleted since the download, the catalog alone does not make it complete
+        if files and all((dataset_catalog.parent / file_path).exists() for file_path in files.split('\n')):
+            done.add(species)
+    return done
+
+def record_species(index, output_dir, species_list, file_types):
+    """Record downloaded species in the index along with the modification time of their catalog and their files"""
+    rows = []
+    for species in species_list:
+        dataset_catalog = catalog_path(output_dir, species)
+        try:
+            mtime_ns = dataset_catalog.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+        files = get_file_paths(dataset_catalog, file_types)
+        # same completeness check as download_genome, an incomplete download is not skipped next time
+        if missing_file_types(files, file_types):
+            continue
+        rows.append((species, ','.join(sorted(file_types)), mtime_ns, '\n'.join(files.values())))
+    with index:
+        index.executemany('INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?)', rows)
+
+def download_genome(species, output_dir, max_retries=3, file_types=['genome', 'gtf'], validate=validate_checksum):
     """
     Download genome and GTF files for a given species using NCBI datasets tool
     
@@ -80,72 +313,89 @@ def download_genome(species, output_dir, max_retries=3, file_types=['genome', 'g
         species (str): Species name or taxon ID
         output_dir (Path): Directory to save downloaded files
         file_types: list of file types to download e.g. genome,gtf,etc
+        validate: callable(file_path, expected_md5) checking files that were not hashed
+            during extraction, None to skip the checksum validation
         
     """
-    # Create species-specific directory
-    species_dir = output_dir / species.replace(" ", "_")
-    species_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Check if the file(s) already exist
-    dataset_catalog = species_dir / "ncbi_dataset" "/data/dataset_catalog.json"
-    md5_path = species_dir / "md5sum.txt"
+    # Check if the file(s) already exist, before touching the filesystem
+    dataset_catalog = catalog_path(output_dir, species)
     files = []
     if dataset_catalog.exists():
         files = get_file_paths(dataset_catalog, file_types)
-        if files:
+        if files and not missing_file_types(files, file_types):
             logging.info(f'Files already exist for {species}')
             return (species, True)
     
+    # Create species-specific directory
+    species_dir = output_dir / species.replace(" ", "_")
+    species_dir.mkdir(parents=True, exist_ok=True)
+    md5_path = species_dir / "md5sum.txt"
+    
     #Download the files
-    # Add random delay before starting download
-    delay = random.uniform(1, 5)
-    time.sleep(delay)
-    logging.info(f"\nProcessing {species} (after {delay:.1f}s delay)...")
+    logging.info(f"Processing {species}...")
     
     try:
         for attempt in range(max_retries):
             logging.info(f'Attempt: {attempt}. Downloading: {species} to {species_dir}')
             # Download genome data using datasets command
             file_types_to_get = ','.join(file_types).replace('fasta', 'genome')
-            cmd = f"datasets download genome taxon \"{species}\" --include {file_types_to_get} --reference"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, cwd=species_dir)
+            # the progress bar is only redrawn into the captured stderr, skip it
+            cmd = [DATASETS_BIN, 'download', 'genome', 'taxon', species, '--include', file_types_to_get, '--reference',
+                   '--no-progressbar']
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd=species_dir)
             if result.returncode == 0:
                 #Unzip downloaded folder that contains the files
                 zip_file =  species_dir / "ncbi_dataset.zip"
                 extract_path = species_dir
                 try:
-                    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                        zip_ref.extractall(extract_path)
-                        # Validate checksums after extraction
-                        if dataset_catalog.exists():
-                            md5_hashes = {'/'.join(x.strip().split(' ')[-1].split('/')[-2:]):x.strip().split(' ')[0]
-                                          for x in open(md5_path, 'r').readlines()}
-                            
-                            files = get_file_paths(dataset_catalog, file_types)
-                            for file_type, file_path in files.items():
-                                files_valid = True
-                                file_full_path = species_dir / "ncbi_dataset" / "data" / file_path
-                                if not validate_checksum(file_full_path, md5_hashes[file_path]):
-                                    logging.warn(f"Checksum validation failed for {file_path}")
-                                    files_valid = False
-                                    break
-                            
-                                if files_valid:
-                                    logging.info(f"Successfully downloaded and validated data for {species}")
-                                    zip_file.unlink()
-                                    return (species, True)
-                                else:
-                                    logging.warn(f"Checksum validation failed for {species}. Retrying...")
-                                    zip_file.unlink()
-                                    continue
+                    extracted_md5 = extract_zip(zip_file, extract_path)
+                    # every requested file type has to be in the catalog (which is missing if the archive was incomplete)
+                    files = get_file_paths(dataset_catalog, file_types)
+                    missing_types = missing_file_types(files, file_types)
+                    if missing_types:
+                        logging.warning(f"No {', '.join(missing_types)} file downloaded for {species}. Retrying...")
+                        zip_file.unlink()
+                        continue
+                    if validate is None:
+                        logging.info(f"Successfully downloaded data for {species} (checksums not validated)")
+                        zip_file.unlink()
+                        return (species, True)
+                    # Validate checksums after extraction
+                    md5_hashes = read_md5sums(md5_path)
+                    files_valid = True
+                    for file_type, file_path in files.items():
+                        file_full_path = species_dir / "ncbi_dataset" / "data" / file_path
+                        # hashed during extraction, files that were not in the archive are read back
+                        file_md5 = extracted_md5.get(f'ncbi_dataset/data/{file_path}')
+                        if file_md5 is not None:
+                            file_valid = file_md5 == md5_hashes[file_path]
+                        else:
+                            file_valid = validate(file_full_path, md5_hashes[file_path])
+                        if not file_valid:
+                            logging.warning(f"Checksum validation failed for {file_path}")
+                            files_valid = False
+                            break
+                    
+                    zip_file.unlink()
+                    if files_valid:
+                        logging.info(f"Successfully downloaded and validated data for {species}")
+                        return (species, True)
+                    logging.warning(f"Checksum validation failed for {species}. Retrying...")
+                    continue
                 except zipfile.BadZipFile as e:
                     logging.error(f'Error in unzipping {species}. Error: {e}')
                 except FileNotFoundError as e:
                     logging.error(f'Error in unzipping {species}. Error: {e}')
             else:
-                logging.error(f"Error getting the results (code: {result.returncode}): {cmd}")
+                logging.error(f"Error getting the results (code: {result.returncode}): {shlex.join(cmd)}")
+                stderr = result.stderr.lower()
+                if attempt < max_retries - 1 and any(marker in stderr for marker in RATE_LIMIT_MARKERS):
+                    # only wait when NCBI is throttling, jittered so parallel workers do not retry in step
+                    delay = min(60, 2 ** attempt + random.uniform(0, 1))
+                    logging.info(f"Retrying {species} in {delay:.1f}s")
+                    time.sleep(delay)
     except Exception as e:
-        logging.error(f"Error processing {species}", e)
+        logging.error(f"Error processing {species}: {e}")
     #remove directory if empty, no download is made
     try:
         species_dir.rmdir()
@@ -164,31 +414,40 @@ def fetch_ncbi_species(max_species, species_list_file=None, search_term='all', a
     Returns:
         list: List of species names.
     """
+    species_list = []
     try:
-        cmd = f"datasets summary genome taxon '{search_term}' --assembly-source {assembly_source} --limit {max_species} --as-json-lines"
+        cmd = [DATASETS_BIN, 'summary', 'genome', 'taxon', search_term, '--assembly-source', assembly_source,
+               '--limit', str(max_species), '--as-json-lines']
         if reference: #limit to reference genomes only
-            cmd+=' --reference'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        if result.returncode != 0:
-            logging.error(f"Error fetching species names: {result.stderr}")
-            return []
-        data_sets = result.stdout.split('\n')
-        species_list = []
+            cmd.append('--reference')
+        seen = set()
         
-        for genome in data_sets:
-            if genome:
-                species_name = json.loads(genome)['organism']['organism_name'].replace("'", "").replace("[", "").replace("]", "")
-                #species_name = genome['assembly_info']['assembly_name']
-                if species_name not in species_list:
-                    species_list.append(species_name)
-                if len(species_list) >= max_species:
-                    break
+        # parse the summaries as they are printed instead of holding the whole output in memory,
+        # stderr goes to a file so a chatty datasets never blocks on a full pipe
+        with tempfile.TemporaryFile() as stderr, subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr) as proc:
+            for genome in proc.stdout:
+                if genome.strip():
+                    species_name = json_loads(genome)['organism']['organism_name'].translate(NAME_CLEANUP)
+                    #species_name = genome['assembly_info']['assembly_name']
+                    if species_name not in seen:
+                        seen.add(species_name)
+                        species_list.append(species_name)
+                    if len(species_list) >= max_species:
+                        # enough species, stop datasets from paging through the remaining genomes
+                        proc.terminate()
+                        break
+            else:
+                if proc.wait() != 0:
+                    stderr.seek(0)
+                    logging.error(f"Error fetching species names: {stderr.read().decode(errors='replace')}")
+                    return []
     except Exception as e:
         logging.error(f"An error occurred: {e}")
     
     if species_list_file and species_list:
         with open(species_list_file, 'w') as species_list_outfile:
-            species_list_outfile.write('\n'.join(list(set(species_list))))
+            # already unique, written in the order NCBI returned them
+            species_list_outfile.write('\n'.join(species_list))
     return species_list
 
 def main():
@@ -220,7 +479,9 @@ def main():
     parser.add_argument("-o", "--output", type=str, default="ncbi_genomes",
                         help="Output directory (default: ncbi_genomes)")
     parser.add_argument("-p", "--processes", type=int, default=1,
-                        help="Number of parallel downloads (default: 1)")
+                        help="Number of species downloaded in parallel threads (default: 1)")
+    parser.add_argument("--no_validate", action='store_true', default=False,
+                        help="Skip the MD5 validation of the downloaded files")
     args = parser.parse_args()
     setup_logging()
     # Create output directory
@@ -232,7 +493,8 @@ def main():
     if args.species:
         species_list = args.species
     elif args.file and os.path.isfile(args.file):
-        species_list = [line.strip() for line in open(args.file, 'r').readlines() if line.strip() if line!=""]
+        with open(args.file, 'r') as species_file:
+            species_list = [name for name in (line.strip() for line in species_file) if name]
     elif args.search_term or args.download_species:
         species_list = fetch_ncbi_species(args.max_species, args.species_list_file, args.search_term, args.assembly_source, args.reference_only)
     else:
@@ -241,14 +503,36 @@ def main():
     if not species_list:
         return []
     
+    # species downloaded by an earlier run are taken from the index without parsing their catalogs
+    index = None
+    done = set()
+    try:
+        index = open_index(output_dir)
+        done = indexed_species(index, output_dir, species_list, args.file_types)
+    except sqlite3.Error as e:
+        # each species is then checked against its own catalog in download_genome
+        logging.warning(f'Cannot use the index {output_dir / INDEX_NAME}, checking the catalog of each species: {e}')
+        if index is not None:
+            index.close()
+            index = None
+    if done:
+        logging.info(f'Files already exist for {len(done)} species listed in {output_dir / INDEX_NAME}')
+    
     # Process species in parallel
-    results = []
-    if args.processes>1:
-        with Pool(processes=args.processes) as pool:
-            results = pool.starmap(download_genome, [(spcies, output_dir, args.max_attempts, ','.join(args.file_types)) for spcies in species_list])
-    else:
-        for spcies in species_list:
-            results.append(download_genome(spcies, output_dir, args.max_attempts, args.file_types))
+    # each download waits on a datasets subprocess, so threads are enough and nothing is forked or pickled
+    fetch = partial(download_genome, output_dir=output_dir, max_retries=args.max_attempts, file_types=args.file_types,
+                    validate=None if args.no_validate else validate_checksum)
+    with ThreadPoolExecutor(max_workers=args.processes) as executor:
+        downloads = dict(executor.map(fetch, [species for species in species_list if species not in done]))
+    if index is not None:
+        try:
+            record_species(index, output_dir, [species for species, success in downloads.items() if success],
+                           args.file_types)
+        except sqlite3.Error as e:
+            logging.warning(f'Cannot record the downloads in {output_dir / INDEX_NAME}: {e}')
+        index.close()
+    
+    results = [(species, True) if species in done else (species, downloads[species]) for species in species_list]
     return results
 
 if __name__ == "__main__":
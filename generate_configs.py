@@ -1,8 +1,28 @@
 import os
+import re
+import sys
 import json
 import logging
+import fnmatch
 import argparse
 from pathlib import Path
+from typing import TextIO
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# extensions of the fasta files, in order of preference
+FASTA_EXTS = ('.fa', '.fasta', '.fna')
+# buffer of the config files, they are written one genome at a time
+OUTPUT_BUFFER_SIZE = 1 << 20
+# aligner index directories, they hold many small files but never the fasta, gtf or README to list
+SKIP_DIRS = frozenset({'star', 'bwa', 'salmon', 'hisat2', 'rsem', 'kallisto', 'bismark', 'bowtie2'})
+# names of the nf-core/references output files listed in the final config, compiled like Path.glob would
+GENOME_FILE_MATCHES = {key: re.compile(fnmatch.translate(pattern)).match for key, pattern in
+                       {'fasta': 'genome.fa*', 'fai': 'genome.fa*.fai', 'gtf': 'genes.gtf', 'bed': 'genes.bed'}.items()}
+# where these are in a genome directory of the nf-core/references output, checked before walking it
+EXPECTED_GENOME_PATHS = {'fasta': 'genome/genome.fa', 'fai': 'genome/genome.fa.fai', 'gtf': 'gtf/genes.gtf',
+                         'bed': 'gtf/genes.bed', 'star': 'genome/index/star'}
 
 def setup_logging():
     """Configure logging settings"""
@@ -11,10 +31,229 @@ def setup_logging():
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
 
+@contextmanager
+def open_output(output_file: str):
+    """
+    Open a config file for writing, - for the standard output which is left open.
+    
+    The config is written to output_file.part and renamed to output_file once complete,
+    so a scan that fails leaves the previous config in place.
+    """
+    if output_file == '-':
+        yield sys.stdout
+        sys.stdout.flush()
+        return
+    part_path = output_file + '.part'
+    try:
+        with open(part_path, 'w', buffering=OUTPUT_BUFFER_SIZE) as output:
+            yield output
+        os.replace(part_path, output_file)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+def compile_file_type_patterns(file_types_to_add):
+    """
+    Compile the *{expression}* glob of each file type once, like Path.rglob would for every species
+    
+    Returns:
+        tuple: Match function of a single alternation of all the globs, used to skip the files
+            that are none of the types in one call, and dict of the match function of each file type
+    """
+    globs = {file_type: fnmatch.translate(f"*{file_expr}*") for file_type, file_expr in file_types_to_add.items()}
+    match_any = re.compile('|'.join(globs.values())).match
+    return match_any, {file_type: re.compile(glob).match for file_type, glob in globs.items()}
+
+def walk_entries(root, skip_dirs=()):
+    """
+    Iterate over the entries below a directory without recursion.
+    
+    Directories are visited depth-first in listing order without following symlinks,
+    like Path.rglob and Path.glob('**/...'), the entries of a directory come before
+    those of its sub directories. Unreadable directories and entries removed
+    during the walk are skipped.
+    
+    Args:
+        root (str): Directory to walk
+        skip_dirs (set): Names of the sub directories that are listed but not walked
+    
+    Yields:
+        tuple: os.DirEntry and whether it is a directory
+    """
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                entries = list(entries)
+        except OSError:
+            # unreadable, or removed since its parent was listed
+            continue
+        sub_dirs = []
+        for entry in entries:
+            # answered from the listing on most filesystems, only those that do not report the
+            # entry type need an lstat, which is done once and can fail if the entry is gone
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir and entry.name not in skip_dirs:
+                sub_dirs.append(entry.path)
+            yield entry, is_dir
+        # the sub directories are walked after the entries of their parent, first one on top
+        stack.extend(reversed(sub_dirs))
+
+def scan_species(species_dir, fasta_exts, file_type_patterns, collect_all=(), match_any=None, skip_dirs=SKIP_DIRS):
+    """
+    Walk a species directory once and find its fasta file and the files of each type.
+    
+    The files come out in the same order as with Path.rglob, see walk_entries. Only the
+    first file is kept for each type, except for the types in collect_all, and the walk
+    stops as soon as nothing further down can change the result.
+    
+    Args:
+        species_dir (str): Species directory to walk
+        fasta_exts (tuple): Fasta extensions, in order of preference
+        file_type_patterns (dict): Compiled file name pattern keyed by file type, see compile_file_type_patterns
+        collect_all (set): File types for which every matching file is kept, e.g. the READMEs
+        match_any (callable): Matches the files of any type, the patterns are only tried on these
+        skip_dirs (set): Names of the sub directories that are not walked
+    
+    Returns:
+        tuple: Path of the fasta file (None if there is none), and dict of the files found per file type
+    """
+    fasta_path, fasta_rank = None, len(fasta_exts)
+    files_found = {file_type: [] for file_type in file_type_patterns}
+    missing = len(files_found.keys() - set(collect_all))
+    for entry, is_dir in walk_entries(species_dir, skip_dirs):
+        if is_dir:
+            continue
+        name = entry.name
+        # a single suffix test for most files, the extension is only looked up for fasta files
+        if fasta_rank and name.endswith(fasta_exts):
+            # a later file only replaces the fasta found so far if its extension is preferred
+            for rank, ext in enumerate(fasta_exts[:fasta_rank]):
+                if name.endswith(ext):
+                    fasta_path, fasta_rank = entry.path, rank
+                    break
+        if match_any is None or match_any(name):
+            # a file can be of several types, e.g. README.gtf
+            for file_type, match in file_type_patterns.items():
+                found = files_found[file_type]
+                if (not found or file_type in collect_all) and match(name):
+                    found.append(entry.path)
+                    if file_type not in collect_all:
+                        missing -= 1
+        if not fasta_rank and not missing and not collect_all:
+            break
+    
+    return fasta_path, files_found
+
+def iter_species_dirs(genome_base):
+    """
+    Iterate over the species directories of a genome directory laid out as {division}/{species}
+    
+    Files next to the division and species directories are skipped.
+    
+    Yields:
+        tuple: Division name, species name and absolute path of the species directory
+    """
+    try:
+        division_entries = os.scandir(os.path.abspath(genome_base))
+    except FileNotFoundError:
+        return
+    with division_entries:
+        for division_entry in division_entries:
+            if not division_entry.is_dir():
+                continue
+            with os.scandir(division_entry.path) as species_entries:
+                for species_entry in species_entries:
+                    if species_entry.is_dir():
+                        yield division_entry.name, species_entry.name, species_entry.path
+
+def write_reference_input_config(output: TextIO,
+                                 ensembl_dir: str = "ensembl_genomes", 
+                                 ncbi_dir: str = "ncbi_genomes",
+                                 file_types_to_add = {'gtf': '.gtf', 'readme': 'README'},
+                                 processes: int = None,
+                                 skip_dirs = SKIP_DIRS):
+    """
+    Write the input config for nf-core/references based on genome directories to a text stream.
+    
+    Each species is written as soon as it is formatted, so the stream can also be
+    e.g. sys.stdout or a gzip.open() file.
+    
+    Args:
+        output (TextIO): Stream the config is written to
+        ensembl_dir (str): Path to directory containing Ensembl genomes
+        ncbi_dir (str): Path to directory containing NCBI genomes
+        processes (int): Number of species directories scanned in parallel threads,
+            None for the ThreadPoolExecutor default
+        skip_dirs (set): Names of the directories not searched inside the species directories
+    """
+    logging.info("Generating input config for nf-core/references...")
+    
+    # Process both Ensembl and NCBI genome directories
+    species_dirs = []
+    for genome_base in [ensembl_dir, ncbi_dir]:
+        # the source starts with the genome directory (and division for Ensembl), checked once per directory
+        is_ensembl, is_ncbi = 'ensembl' in genome_base, 'ncbi' in genome_base
+        for division_dir, species, species_dir in iter_species_dirs(genome_base):
+            if is_ensembl:
+                source_prefix = f"{genome_base} {division_dir}"
+            elif is_ncbi:
+                source_prefix = genome_base
+            else:
+                source_prefix = None
+            species_dirs.append((source_prefix, species, species_dir))
+    # Recursively search for fasta/fa/fna files and the other file types in a single walk per species,
+    # the walks mostly wait on the filesystem so they run side by side and are formatted in order.
+    # Every README is listed, only the first file is used for the other types
+    match_any, file_type_patterns = compile_file_type_patterns(file_types_to_add)
+    scan = partial(scan_species, fasta_exts=FASTA_EXTS, file_type_patterns=file_type_patterns, match_any=match_any,
+                   skip_dirs=frozenset(skip_dirs),
+                   collect_all={file_type for file_type, file_expr in file_types_to_add.items() if 'README' in file_expr})
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        separator = ''
+        scans = executor.map(scan, [species_dir for *_, species_dir in species_dirs])
+        for (source_prefix, species, species_dir), (fasta_path, type_files) in zip(species_dirs, scans):
+            logging.debug('Browsing %s', species_dir)
+            
+            if fasta_path is None:
+                continue
+            
+            lines_to_add = []
+            for file_type, file_expr in file_types_to_add.items():
+                files_found = type_files[file_type]
+                if files_found:
+                    file_path = files_found[0]
+                    if 'README' in file_expr:
+                        file_path = ','.join(files_found)
+                    lines_to_add.append(f'            {file_type}: "{file_path}"')    
+                else:
+                    logging.info(f'No {file_type} is found in {species_dir}')
+            # Get the immediate parent directory name of the fasta as the assembly name
+            source = ''
+            if source_prefix is not None:
+                source = f"{source_prefix} {os.path.basename(os.path.dirname(fasta_path))}".replace(' ', '_')
+            
+            output.write(separator)
+            output.write('\n'.join([
+                f'- genome: "{species}"',
+                f'            fasta: "{fasta_path}"',
+                '\n'.join(lines_to_add),
+                f'            species: "{species}"',
+                f'            source: "{source}"',
+                ]))
+            # no newline after the last species
+            separator = '\n'
+
 def generate_reference_input_config(ensembl_dir: str = "ensembl_genomes", 
                                   ncbi_dir: str = "ncbi_genomes",
                                   output_file: str = "reference_input.config",
-                                  file_types_to_add = {'gtf': '.gtf', 'readme': 'README'}):
+                                  file_types_to_add = {'gtf': '.gtf', 'readme': 'README'},
+                                  processes: int = None,
+                                  skip_dirs = SKIP_DIRS):
     """
     Generate input config file for nf-core/references based on genome directories.
     
@@ -22,60 +261,84 @@ def generate_reference_input_config(ensembl_dir: str = "ensembl_genomes",
         ensembl_dir (str): Path to directory containing Ensembl genomes
         ncbi_dir (str): Path to directory containing NCBI genomes
         output_file (str): Output config file path
+        processes (int): Number of species directories scanned in parallel threads,
+            None for the ThreadPoolExecutor default
+        skip_dirs (set): Names of the directories not searched inside the species directories
     """
-    logging.info("Generating input config for nf-core/references...")
+    with open_output(output_file) as f:
+        write_reference_input_config(f, ensembl_dir, ncbi_dir, file_types_to_add, processes, skip_dirs)
     
-    config_content = []
-    # Process both Ensembl and NCBI genome directories
-    for genome_base in [ensembl_dir, ncbi_dir]:
-        if not os.path.exists(genome_base):
+    logging.info(f"Generated {output_file}")
+
+def find_genome_files(genome_dir):
+    """
+    Walk a genome directory of the nf-core/references output once and find the files of the final config.
+    
+    The files at their usual place (EXPECTED_GENOME_PATHS) are taken with a single stat each,
+    only the ones missing there are searched for. Of these the first match in the order of
+    Path.glob('**/...') is kept, see walk_entries, and the walk stops once everything is found.
+    
+    Args:
+        genome_dir (str): Genome directory to walk
+    
+    Returns:
+        dict: Path of the fasta, fai, gtf and bed files and of the star index directory, for the ones found
+    """
+    found = {}
+    for key, expected_path in EXPECTED_GENOME_PATHS.items():
+        path = os.path.join(genome_dir, expected_path)
+        if os.path.isdir(path) if key == 'star' else os.path.isfile(path):
+            found[key] = path
+    if len(found) == len(EXPECTED_GENOME_PATHS):
+        return found
+    
+    for entry, _ in walk_entries(genome_dir):
+        name = entry.name
+        for key, match in GENOME_FILE_MATCHES.items():
+            if key not in found and match(name):
+                found[key] = entry.path
+        if name == 'star' and 'star' not in found:
+            try:
+                if entry.is_dir():
+                    found['star'] = entry.path
+            except OSError:
+                pass
+        if len(found) == len(EXPECTED_GENOME_PATHS):
+            break
+    return found
+
+def write_final_config(output: TextIO, input_dir: str = "results"):
+    """
+    Write the final genomes config after running nf-core/references to a text stream.
+    
+    Args:
+        output (TextIO): Stream the config is written to
+        input_dir (str): Directory containing nf-core/references output
+    """
+    output.write('\n'.join(["params {", "    genomes {"]))
+    
+    for genome_dir in Path(input_dir).iterdir():
+        if not genome_dir.is_dir():
             continue
-        # Recursively walk through all subdirectories
-        for division_dir in os.listdir(genome_base):
-            # Skip if this is the base directory itself
-            for species in os.listdir(genome_base+'/'+division_dir):
-                fasta_files = []
-                species_dir = Path(os.path.abspath(genome_base)) / division_dir / species
-                print('browsing species_dir', species_dir)
-                # Get the immediate parent directory name as the genome name
-                source = ''
-                
-                # Recursively search for fasta/fa/fna files
-                for ext in ["*.fa", "*.fasta", "*.fna"]:
-                    fasta_files.extend(list(species_dir.rglob(ext)))
-                if not fasta_files:
-                    continue
-                
-                fasta_path = str(fasta_files[0])
-                
-                lines_to_add = []
-                for file_type, file_expr in file_types_to_add.items():
-                    files_found = list(species_dir.rglob(f"*{file_expr}*"))
-                    if files_found:
-                        file_path = str(files_found[0])
-                        if 'README' in file_expr:
-                            file_path = ','.join([str(x) for x in files_found])
-                        lines_to_add.append(f'            {file_type}: "{file_path}"')    
-                    else:
-                        print(f'No {file_type} is found in {species_dir}')
-                if 'ensembl' in genome_base:
-                    source = f"{genome_base} {division_dir} {fasta_path.split('/')[-2]}".replace(' ', '_')
-                elif 'ncbi' in genome_base:
-                    source = f"{genome_base} {fasta_path.split('/')[-2]}".replace(' ', '_')
-                
-                config_content.extend([
-                    f'- genome: "{species}"',
-                    f'            fasta: "{fasta_path}"',
-                    '\n'.join(lines_to_add),
-                    f'            species: "{species}"',
-                    f'            source: "{source}"',
-                    ])
-    
-    # Write the config file
-    with open(output_file, 'w') as f:
-        f.write('\n'.join(config_content))
+            
+        genome_name = genome_dir.name
+        
+        # Find relevant files in a single walk
+        genome_files = find_genome_files(str(genome_dir))
+        
+        if 'fasta' in genome_files:
+            output.write('\n')
+            output.write('\n'.join([
+                f"        '{genome_name}' {{",
+                f"            fasta   = '{genome_files['fasta']}'",
+                f"            fai     = '{genome_files.get('fai', '')}'",
+                f"            gtf     = '{genome_files.get('gtf', '')}'",
+                f"            bed     = '{genome_files.get('bed', '')}'",
+                f"            star    = '{genome_files.get('star', '')}'",
+                "        }"
+            ]))
     
-    logging.info(f"Generated {output_file}")
+    output.write('\n'.join(["", "    }", "}"]))
 
 def generate_final_config(input_dir: str = "results", 
                          output_file: str = "configs/genomes.config"):
@@ -91,41 +354,12 @@ def generate_final_config(input_dir: str = "results",
     # Create configs directory if it doesn't exist
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
-    config_content = ["params {", "    genomes {"]
-    
     if not os.path.exists(input_dir):
         logging.warn(f"Warning: Input directory {input_dir} does not exist")
         return
     
-    for genome_dir in Path(input_dir).iterdir():
-        if not genome_dir.is_dir():
-            continue
-            
-        genome_name = genome_dir.name
-        
-        # Find relevant files
-        fasta = next(genome_dir.glob("**/genome.fa*"), None)
-        fai = next(genome_dir.glob("**/genome.fa*.fai"), None)
-        gtf = next(genome_dir.glob("**/genes.gtf"), None)
-        bed = next(genome_dir.glob("**/genes.bed"), None)
-        star_index = next((d for d in genome_dir.glob("**/star") if d.is_dir()), None)
-        
-        if fasta:
-            config_content.extend([
-                f"        '{genome_name}' {{",
-                f"            fasta   = '{fasta}'",
-                f"            fai     = '{fai if fai else ''}'",
-                f"            gtf     = '{gtf if gtf else ''}'",
-                f"            bed     = '{bed if bed else ''}'",
-                f"            star    = '{star_index if star_index else ''}'",
-                "        }"
-            ])
-    
-    config_content.extend(["    }", "}"])
-    
-    # Write the config file
-    with open(output_file, 'w') as f:
-        f.write('\n'.join(config_content))
+    with open_output(output_file) as f:
+        write_final_config(f, input_dir)
     
     logging.info(f"Generated {output_file}")
 
@@ -137,10 +371,15 @@ def main():
     parser.add_argument('--ncbi-dir', default='ncbi_genomes',
                       help='Path to directory containing NCBI genomes')
     parser.add_argument('--output-file', default='references.yml',
-                      help='Output config file path')
+                      help='Output config file path, - for the standard output')
     parser.add_argument('--file-types', type=json.loads, 
                       default='{"gtf": ".gtf", "readme": "README"}',
                       help='JSON string of file types to add (e.g., \'{"gtf": ".gtf", "readme": "README"}\')')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                      help='Number of species directories scanned in parallel threads (default: min(32, CPUs + 4))')
+    parser.add_argument('--skip-dirs', nargs='*', default=sorted(SKIP_DIRS),
+                      help='Names of the directories not searched inside the species directories, '
+                           'pass the option without names to search all of them (default: aligner indices)')
     
     args = parser.parse_args()
     setup_logging()
@@ -150,7 +389,9 @@ def main():
         ensembl_dir=args.ensembl_dir,
         ncbi_dir=args.ncbi_dir,
         output_file=args.output_file,
-        file_types_to_add=args.file_types
+        file_types_to_add=args.file_types,
+        processes=args.processes,
+        skip_dirs=args.skip_dirs
     )
     
     # Generate final config file